@@ -0,0 +1,288 @@
+"""
+Benchmarks of the data pipeline in functions.py against synthetic prices.
+
+The documents follow the schemas of the 'alimentacion', 'vivienda' and 'energia'
+collections and are served by an in-process MongoDB stand-in (mongomock), so no
+database is needed. Results are written as JSON to compare them across commits.
+
+Usage:
+    pip install -r requirements-bench.txt
+    python benchmark.py --days 365 --output bench.json
+    python benchmark.py --days 365 --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import bson
+import mongomock
+import numpy as np
+
+from functions import *
+
+# Names used to build the synthetic product lists, extended with a suffix when more are needed
+ALIMENTOS = list(PESOS_PRODUCTOS["alimentacion"])
+COMBUSTIBLES = list(PESOS_PRODUCTOS["energia"])
+TIPOS_VIVIENDA = ["venta", "alquiler"]
+TIENDAS = ["mercadona", "carrefour", "dia", "lidl", "alcampo", "eroski", "aldi"]
+PROVINCIAS = ["Madrid", "Barcelona", "Sevilla", "Valencia", "Málaga", "Zaragoza"]
+FUENTES_VIVIENDA = ["idealista", "fotocasa"]
+
+
+def _names(base, n):
+    return [base[i % len(base)] + ("" if i < len(base) else f" {i}") for i in range(n)]
+
+
+def generatePrices(days=365, products=17, stores=5, provinces=10, seed=0):
+    """
+    Generate synthetic documents with the schema of each price collection.
+
+    Every product is scraped once a day per store (alimentacion), per province and
+    source (vivienda, plus the national 'España' series) or per source (energia),
+    as a random walk ending today.
+
+    Returns:
+        Dict[str, List[dict]]: Documents of 'alimentacion', 'vivienda' and 'energia'.
+    """
+    rng = np.random.default_rng(seed)
+    end = datetime.now().replace(hour=8, minute=0, second=0, microsecond=0)
+    fechas = [end - timedelta(days=days - 1 - day) for day in range(days)]
+
+    def walk(n_series, start, scale):
+        steps = rng.normal(0, scale, size=(days, n_series))
+        return start * np.exp(np.cumsum(steps, axis=0))
+
+    alimentos = _names([name.lower() for name in ALIMENTOS], products)
+    tiendas = _names(TIENDAS, stores)
+    precios = walk(len(alimentos) * len(tiendas), rng.uniform(0.5, 10), 0.01)
+    alimentacion = [
+        {
+            "fecha": fecha,
+            "producto": producto,
+            "precio_referencia": float(precios[day, p * len(tiendas) + t]),
+            "tienda": tienda,
+        }
+        for day, fecha in enumerate(fechas)
+        for p, producto in enumerate(alimentos)
+        for t, tienda in enumerate(tiendas)
+    ]
+
+    provincias = ["España", *_names(PROVINCIAS, provinces)]
+    series = [
+        (tipo, provincia, fuente)
+        for tipo in TIPOS_VIVIENDA
+        for provincia in provincias
+        for fuente in FUENTES_VIVIENDA
+    ]
+    precios = walk(len(series), rng.uniform(10, 3000), 0.002)
+    vivienda = [
+        {
+            "fecha": fecha,
+            "tipo": tipo,
+            "provincia": provincia,
+            "precio": float(precios[day, s]),
+            "fuente": fuente,
+        }
+        for day, fecha in enumerate(fechas)
+        for s, (tipo, provincia, fuente) in enumerate(series)
+    ]
+
+    combustibles = _names(COMBUSTIBLES, max(1, products // 2))
+    precios = walk(len(combustibles), rng.uniform(0.1, 2), 0.01)
+    energia = [
+        {
+            "fecha": fecha,
+            "combustible": combustible,
+            "precio": float(precios[day, c]),
+            "fuente": "minetur",
+        }
+        for day, fecha in enumerate(fechas)
+        for c, combustible in enumerate(combustibles)
+    ]
+
+    return {"alimentacion": alimentacion, "vivienda": vivienda, "energia": energia}
+
+
+class _RawBatchCursor:
+    # Raw BSON batches over a mongomock cursor, like pymongo's RawBatchCursor
+    def __init__(self, cursor, batch_size=1000):
+        self._cursor = cursor
+        self._batch_size = batch_size
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def __iter__(self):
+        batch = []
+        for doc in self._cursor:
+            batch.append(bson.encode(doc))
+            if len(batch) == self._batch_size:
+                yield b"".join(batch)
+                batch = []
+        if batch:
+            yield b"".join(batch)
+
+
+class StandInCollection(mongomock.Collection):
+    # mongomock does not implement the raw batch cursors used by the loaders
+    def find_raw_batches(self, *args, **kwargs):
+        return _RawBatchCursor(self.find(*args, **kwargs))
+
+    def aggregate_raw_batches(self, pipeline, **kwargs):
+        return _RawBatchCursor(self.aggregate(pipeline))
+
+
+def standInClient(documents):
+    """
+    In-process MongoDB stand-in holding the given documents in DATABASE.
+    """
+    client = mongomock.MongoClient()
+    mydb = client[DATABASE]
+    for collection, docs in documents.items():
+        # Register the subclass so mydb[collection] returns it
+        mydb._collection_accesses[collection] = StandInCollection(
+            mydb, collection, _db_store=mydb._store
+        )
+        mydb[collection].insert_many(docs)
+        mydb[collection].create_index("fecha")
+    return client
+
+
+def timeStage(function, repeat):
+    """
+    Run `function` `repeat` times.
+
+    Returns:
+        Tuple[dict, Any]: Timings in seconds (min, median) and the last result.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        timings.append(perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings)}, result
+
+
+def _rows(result):
+    if isinstance(result, dict):
+        return sum(_rows(value) for value in result.values())
+    return len(result)
+
+
+def runBenchmarks(repeat=3, ago=30, **params):
+    documents = generatePrices(**params)
+    setMongoClient(standInClient(documents))
+
+    results = {}
+
+    def stage(name, function):
+        timings, result = timeStage(function, repeat)
+        results[name] = {**timings, "rows": _rows(result)}
+        print(f"{name:<36} {timings['median']:>9.4f}s  {results[name]['rows']:>9} rows")
+        return result
+
+    stage("getAlimentacionJson", getAlimentacionJson)
+    stage("getViviendaJson", getViviendaJson)
+    stage("getEnergiaJson", getEnergiaJson)
+    stage("getAlimentacionFrame", getAlimentacionFrame)
+    stage("getViviendaFrame", getViviendaFrame)
+    stage("getEnergiaFrame", getEnergiaFrame)
+    stage("getDailyProductPrices", getDailyProductPrices)
+    prod_prices = stage("getProductPrices", getProductPrices)
+
+    sector_df = {
+        "energia": normalize_luz(prod_prices["energia"].copy()),
+        "vivienda": preprocess_vivienda(prod_prices["vivienda"]),
+        "alimentacion": prod_prices["alimentacion"],
+    }
+    prod_infl = {}
+    for sector, prices in sector_df.items():
+        prod_infl[sector] = stage(
+            f"calcInflationProds[{sector}]", lambda: calcInflationProds(prices, ago)
+        )
+    for sector, prices in prod_prices.items():
+        stage(
+            f"calcInflationFuentes[{sector}]", lambda: calcInflationFuentes(prices, ago)
+        )
+    for sector, prices in sector_df.items():
+        stage(
+            f"calcInflationProdsHorizons[{sector}]",
+            lambda: calcInflationProdsHorizons(prices),
+        )
+
+    categs_infl = stage(
+        "getCategoriesInflation", lambda: getCategoriesInflation(prod_infl)
+    )
+    stage("getTotalInflation", lambda: getTotalInflation(categs_infl))
+
+    return results
+
+
+def gitCommit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compareResults(results, baseline):
+    print(f"\n{'stage':<36} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, timings in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["median"]
+        after = timings["median"]
+        ratio = after / before if before else float("nan")
+        print(f"{name:<36} {before:>9.4f}s {after:>9.4f}s {ratio:>6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Chainflation pipeline")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--products", type=int, default=17)
+    parser.add_argument("--stores", type=int, default=5)
+    parser.add_argument("--provinces", type=int, default=10)
+    parser.add_argument("--ago", type=int, default=30, help="Inflation horizon in days")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    params = {
+        "days": args.days,
+        "products": args.products,
+        "stores": args.stores,
+        "provinces": args.provinces,
+        "seed": args.seed,
+    }
+    results = runBenchmarks(repeat=args.repeat, ago=args.ago, **params)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compareResults(results, json.load(f)["results"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": gitCommit(),
+                    "date": datetime.now().isoformat(timespec="seconds"),
+                    "params": {**params, "ago": args.ago, "repeat": args.repeat},
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class StaleWhileRevalidate:
+    """
+    Cache a dataset and keep serving it after its TTL expires while a background
+    thread fetches the new version.
+
+    Only the very first access blocks on the loader. Afterwards get() always
+    returns immediately: with the cached value while it is fresh, and with the
+    stale value while the refresh runs. The new value is swapped in atomically.
+
+    Args:
+        load (Callable[[], Any]): Loads the dataset from scratch.
+        ttl (float): Seconds a loaded value is considered fresh.
+        refresh (Callable[[Any], Any]): Builds the new version from the current one,
+                                        e.g. an incremental reload. Defaults to `load`.
+    """
+
+    def __init__(self, load, ttl, refresh=None):
+        self._load = load
+        self._refresh = refresh or (lambda value: load())
+        self.ttl = ttl
+
+        # (value, loaded_at, version), always replaced as a whole
+        self._entry = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def version(self):
+        """Number of times the value has been (re)loaded, 0 before the first load."""
+        entry = self._entry
+        return 0 if entry is None else entry[2]
+
+    def peek(self):
+        """The current value, or None before the first load. Never loads nor refreshes."""
+        entry = self._entry
+        return None if entry is None else entry[0]
+
+    def get(self):
+        return self.getVersioned()[0]
+
+    def getVersioned(self):
+        """Return the current value together with its version, read atomically."""
+        entry = self._entry
+        if entry is None:
+            with self._lock:
+                if self._entry is None:
+                    self._entry = (self._load(), time.monotonic(), 1)
+                entry = self._entry
+
+        value, loaded_at, version = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            self._startRefresh()
+        return value, version
+
+    def _startRefresh(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._runRefresh, daemon=True).start()
+
+    def _runRefresh(self):
+        value, loaded_at, version = self._entry
+        try:
+            self._entry = (self._refresh(value), time.monotonic(), version + 1)
+        except Exception:
+            # Keep serving the stale value and try again after another TTL
+            logger.exception("Background refresh failed")
+            self._entry = (value, time.monotonic(), version)
+        finally:
+            self._refreshing = False
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache bounded by entry count and total size.
+
+    Args:
+        max_bytes (int): Total size of the stored values, as measured by `size`.
+        max_entries (int): Maximum number of stored values.
+        size (Callable[[Any], int]): Size of a value in bytes. Defaults to len().
+    """
+
+    def __init__(self, max_bytes, max_entries=None, size=len):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._size = size
+
+        # key -> (value, size), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = self._size(value)
+        if nbytes > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+
+            while self._bytes > self.max_bytes or (
+                self.max_entries is not None and len(self._entries) > self.max_entries
+            ):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
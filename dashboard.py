@@ -1,34 +1,282 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
 from dotenv import load_dotenv
-from functions import *
-import folium
-from streamlit_folium import st_folium
-import plotly.express as px
-import requests
+
+load_dotenv()  # Antes de importar functions, que lee su configuración del entorno
+
+from functions import (
+    OFFLINE,
+    WINDOW_DAYS,
+    concatPrices,
+    getHistoricalPrices,
+    loadCategoriesInflation,
+    loadProductPrices,
+    memoryFootprint,
+)
+from cache import LRUCache, StaleWhileRevalidate
+from downsample import WEBGL_MIN_POINTS, downsampleFrame
+from instrumentation import enableMetricsLog, span, stageStats, timed
+from provincias import joinProvincias, loadGeojson, provinciaNames
 from streamlit_option_menu import option_menu
-import plotly.graph_objects as go
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
+import functools
+import os
+
+# Plotly y folium se importan en las funciones que los usan, para que el primer
+# render no espere por ellos (ver startup.py)
+
+# Copy-on-write: los filtros y columnas derivadas nunca modifican los datos en caché
+pd.set_option("mode.copy_on_write", True)
 
-load_dotenv()
+# Métricas de cada etapa como líneas JSON en stdout (idempotente entre reruns)
+enableMetricsLog()
 
 # Configuración básica de Streamlit
 st.set_page_config(page_title="Chainflation - Dashboard", page_icon="📊", layout="wide")
 
 
-@st.cache_resource(hash_funcs={"pymongo.mongo_client.MongoClient": id})
-def load_data():
+# Segundos que los datos se consideran frescos antes de recargarlos en segundo plano
+CACHE_TTL = int(os.environ.get("chainflation_cache_ttl", 3600))
+
+# Límites de la caché de figuras compartida entre sesiones
+FIGURE_CACHE_MB = int(os.environ.get("chainflation_figure_cache_mb", 256))
+FIGURE_CACHE_ENTRIES = int(os.environ.get("chainflation_figure_cache_entries", 512))
+
+
+@st.cache_resource
+def get_datasets():
+    """
+    Crea, una vez por proceso, las cachés compartidas por todas las sesiones.
+
+    Ninguna carga datos al crearse: cada conjunto se carga la primera vez que una
+    página lo pide.
+
+    Returns:
+        dict: Caché stale-while-revalidate de cada conjunto de datos.
+    """
+    return {
+        "category_infl": StaleWhileRevalidate(loadCategoriesInflation, CACHE_TTL),
+        **{
+            sector: StaleWhileRevalidate(
+                functools.partial(loadProductPrices, sectores=[sector]),
+                CACHE_TTL,
+                refresh=loadProductPrices,
+            )
+            for sector in ("alimentacion", "vivienda")
+        },
+    }
+
+
+@st.cache_resource
+def get_figure_cache():
+    """
+    Crea, una vez por proceso, la caché LRU de figuras serializadas.
+    """
+    return LRUCache(FIGURE_CACHE_MB * 2**20, max_entries=FIGURE_CACHE_ENTRIES)
+
+
+def figura_cacheada(clave, construir):
+    """
+    Devuelve la figura guardada para `clave` o la construye y la guarda en JSON.
+
+    Args:
+        clave (tuple): Versión de los datos, página, gráfico y filtros que la determinan.
+        construir (Callable[[], go.Figure]): Construye la figura si no está en caché.
+
+    Returns:
+        go.Figure: Figura de Plotly.
+    """
+    figuras = get_figure_cache()
+    serializada = figuras.get(clave)
+    if serializada is not None:
+        import plotly.io as pio
+
+        return pio.from_json(serializada)
+
+    fig = construir()
+    figuras.put(clave, fig.to_json())
+    return fig
+
+
+def capitalizar_productos(df):
+    """
+    Capitaliza los nombres de producto, sobre las categorías si la columna es categórica.
+    """
+    productos = df["producto"]
+    if isinstance(productos.dtype, pd.CategoricalDtype):
+        categorias = productos.cat.categories.str.capitalize()
+        if categorias.is_unique:
+            return df.assign(producto=productos.cat.rename_categories(categorias))
+    return df.assign(producto=productos.astype(str).str.capitalize())
+
+
+@st.cache_resource(max_entries=2)
+@timed()
+def build_alimentacion_view(data_version, _precios):
+    """
+    Prepara, una vez por versión de los datos, las vistas de la página de alimentación.
+
+    Las vistas se comparten entre todas las sesiones y no deben modificarse: las
+    funciones de las páginas solo filtran o crean copias.
+
+    Args:
+        data_version (int): Versión de los precios de alimentación.
+        _precios (DataFrame): Precios de alimentación (no forma parte de la clave).
+
+    Returns:
+        dict: Vistas listas para mostrar ('alimentacion' con su índice en
+              'alimentacion_indice', 'supermercados', 'productos_mas_baratos') y la
+              versión de los datos.
+    """
+    alimentacion_df = capitalizar_productos(_precios)
+    alimentacion_indexado, indice = indexar_por_fecha(alimentacion_df, "fuente")
+
+    return {
+        "version": data_version,
+        "alimentacion": alimentacion_indexado,
+        "alimentacion_indice": indice,
+        "supermercados": list(alimentacion_df["fuente"].unique()),
+        "productos_mas_baratos": comparar_precios_entre_supermercados(alimentacion_df),
+    }
+
+
+@st.cache_resource(max_entries=2)
+@timed()
+def build_vivienda_view(data_version, _precios):
+    """
+    Prepara, una vez por versión de los datos, la vista de la página de vivienda.
+
+    Args:
+        data_version (int): Versión de los precios de vivienda.
+        _precios (DataFrame): Precios de vivienda (no forma parte de la clave).
+
+    Returns:
+        dict: Precios por provincia sin el total nacional ('vivienda', con su índice
+              en 'vivienda_indice') y la versión de los datos.
+    """
+    vivienda_df = capitalizar_productos(_precios[_precios["provincia"] != "España"])
+    vivienda_indexado, indice = indexar_por_fecha(vivienda_df, "producto")
+
+    return {
+        "version": data_version,
+        "vivienda": vivienda_indexado,
+        "vivienda_indice": indice,
+    }
+
+
+@st.cache_resource(max_entries=4)
+@timed()
+def build_historical_view(sector, desde, data_version, _vista, clave):
+    """
+    Amplía la vista de un sector con los precios anteriores a los cargados en memoria.
+
+    Args:
+        sector (str): 'alimentacion' o 'vivienda'.
+        desde (Timestamp): Primer día del mes desde el que se quieren precios.
+        data_version (int): Versión de los datos de precios.
+        _vista (DataFrame): Vista del sector (no forma parte de la clave).
+        clave (str): Columna por la que está indexada la vista.
+
+    Returns:
+        tuple: La vista con la historia añadida y su índice (ver indexar_por_fecha).
+    """
+    historia = getHistoricalPrices(desde, _vista["fecha"].min(), [sector])[sector]
+    if sector == "vivienda":
+        historia = historia[historia["provincia"] != "España"]
+    historia = capitalizar_productos(historia)
+
+    return indexar_por_fecha(concatPrices([historia, _vista]), clave)
+
+
+def vista_con_historia(views, sector, fecha_inicio):
+    """
+    Devuelve la vista del sector que cubre desde fecha_inicio, cargando de MongoDB por
+    meses solo la historia que falte.
+
+    Returns:
+        tuple: La vista y su índice, que solo es válido para esa vista.
+    """
+    vista, indice = views[sector], views[f"{sector}_indice"]
+    fecha_inicio = pd.Timestamp(fecha_inicio)
+    if OFFLINE or len(vista) == 0 or fecha_inicio >= vista["fecha"].min():
+        return vista, indice
+    # Desde el principio del mes, para que fechas cercanas compartan la misma vista
+    desde = fecha_inicio.to_period("M").to_timestamp()
+    return build_historical_view(
+        sector, desde, views["version"], vista, indice["clave"]
+    )
+
+
+def rango_cargado(vista):
+    """
+    Rango de fechas que ya está en memoria, para usarlo como valor por defecto de los
+    filtros: la historia anterior solo se carga si el usuario elige fechas más antiguas.
+
+    Returns:
+        tuple: Primer día completo y último día de la vista.
+    """
+    if len(vista) == 0:
+        return date.today() - timedelta(days=WINDOW_DAYS), date.today()
+    # El primer día puede empezar a media mañana si la ventana no empieza a medianoche
+    return vista["fecha"].min().ceil("D").date(), vista["fecha"].max().date()
+
+
+def load_category_infl():
+    """
+    Carga la inflación por categorías, lo único que necesita la página General.
+
+    Tras la primera carga nunca espera a MongoDB: si los datos han caducado se
+    devuelven los actuales mientras se recargan en segundo plano (igual en las
+    demás funciones load_*).
+
+    Returns:
+        DataFrame: Inflación por categorías.
+    """
+    return get_datasets()["category_infl"].get()
+
+
+def load_alimentacion():
     """
-    Carga los datos de precios de productos y categorías de inflación desde MongoDB.
+    Carga los precios de alimentación la primera vez que se abre su página.
 
     Returns:
-        prod_prices (dict): Diccionario que contiene los precios de los productos (alimentación, vivienda, energía).
-        category_infl (DataFrame): DataFrame que contiene la inflación por categorías.
+        dict: Vistas de solo lectura (ver build_alimentacion_view).
+    """
+    precios, data_version = get_datasets()["alimentacion"].getVersioned()
+    return build_alimentacion_view(data_version, precios["alimentacion"])
+
+
+def load_vivienda():
+    """
+    Carga los precios de vivienda la primera vez que se abre su página.
+
+    Returns:
+        dict: Vistas de solo lectura (ver build_vivienda_view).
+    """
+    precios, data_version = get_datasets()["vivienda"].getVersioned()
+    return build_vivienda_view(data_version, precios["vivienda"])
+
+
+def display_debug_panel():
+    """
+    Muestra en la barra lateral los tiempos por etapa (p50/p95) y la memoria de los
+    precios ya cargados, solo con ?debug=1 en la URL.
     """
-    prod_prices = getProductPrices()
-    category_infl = getCategoriesInflation()
-    return prod_prices, category_infl
+    if st.query_params.get("debug") != "1":
+        return
+    with st.sidebar.expander("⏱️ Rendimiento", expanded=True):
+        st.dataframe(stageStats(), use_container_width=True)
+
+        # Solo los conjuntos ya cargados: el panel nunca dispara una carga
+        datasets = get_datasets()
+        precios = {
+            sector: df
+            for nombre in ("alimentacion", "vivienda")
+            for sector, df in (datasets[nombre].peek() or {}).items()
+        }
+        if precios:
+            st.dataframe(memoryFootprint(precios), use_container_width=True)
 
 
 def display_sidebar_menu():
@@ -49,7 +297,58 @@ def display_sidebar_menu():
     return menu
 
 
-def filter_vivienda_data(vivienda_df, producto_tipo, fecha_inicio, fecha_fin):
+def indexar_por_fecha(df, clave):
+    """
+    Ordena los precios por (clave, fecha) y calcula dónde empieza y acaba cada valor de
+    la clave, para filtrar rangos de fechas con búsqueda binaria.
+
+    El índice se devuelve aparte y no en df.attrs, que pandas copia a cualquier
+    DataFrame derivado aunque sus filas estén en otro orden.
+
+    Args:
+        df (DataFrame): Precios con una columna 'fecha'.
+        clave (str): Columna por la que se filtra, p. ej. 'fuente' o 'producto'.
+
+    Returns:
+        tuple: Los datos ordenados por (clave, fecha) y su índice, un dict con la
+               clave y las posiciones (inicio, fin) de cada valor.
+    """
+    df = df.sort_values([clave, "fecha"], kind="stable")
+    posiciones = df.groupby(clave, observed=True, sort=False).indices
+    indice = {
+        "clave": clave,
+        "limites": {valor: (pos[0], pos[-1] + 1) for valor, pos in posiciones.items()},
+    }
+    return df, indice
+
+
+def filtrar_por_clave_y_fechas(df, clave, valor, fecha_inicio, fecha_fin, indice=None):
+    """
+    Filtra las filas con df[clave] == valor y fecha entre fecha_inicio y fecha_fin.
+
+    Con el índice que indexar_por_fecha devolvió junto a df solo se recorren las
+    filas devueltas; sin él, se usan máscaras sobre todo el DataFrame.
+    """
+    fecha_inicio = pd.to_datetime(fecha_inicio)
+    fecha_fin = pd.to_datetime(fecha_fin)
+
+    if indice is None or indice["clave"] != clave:
+        return df[
+            (df[clave] == valor)
+            & (df["fecha"] >= fecha_inicio)
+            & (df["fecha"] <= fecha_fin)
+        ]
+
+    inicio, fin = indice["limites"].get(valor, (0, 0))
+    fechas = df["fecha"].to_numpy()[inicio:fin]
+    desde = inicio + np.searchsorted(fechas, fecha_inicio.to_datetime64(), "left")
+    hasta = inicio + np.searchsorted(fechas, fecha_fin.to_datetime64(), "right")
+    return df.iloc[desde:hasta]
+
+
+def filter_vivienda_data(
+    vivienda_df, producto_tipo, fecha_inicio, fecha_fin, indice=None
+):
     """
     Filtra los datos de precios de vivienda por tipo de producto (venta o alquiler) y fechas.
 
@@ -58,18 +357,19 @@ def filter_vivienda_data(vivienda_df, producto_tipo, fecha_inicio, fecha_fin):
         producto_tipo (str): Tipo de producto, puede ser 'Venta' o 'Alquiler'.
         fecha_inicio (datetime): Fecha de inicio del rango.
         fecha_fin (datetime): Fecha de fin del rango.
+        indice (dict): Índice de vivienda_df devuelto por indexar_por_fecha, si lo hay.
 
     Returns:
         DataFrame: Datos filtrados por tipo de producto y fechas.
     """
-    return vivienda_df[
-        (vivienda_df["producto"] == producto_tipo)
-        & (vivienda_df["fecha"] >= pd.to_datetime(fecha_inicio))
-        & (vivienda_df["fecha"] <= pd.to_datetime(fecha_fin))
-    ]
+    return filtrar_por_clave_y_fechas(
+        vivienda_df, "producto", producto_tipo, fecha_inicio, fecha_fin, indice
+    )
 
 
-def filter_alimentacion_data(alimentacion_df, supermercado, fecha_inicio, fecha_fin):
+def filter_alimentacion_data(
+    alimentacion_df, supermercado, fecha_inicio, fecha_fin, indice=None
+):
     """
     Filtra los datos de precios de alimentación por supermercado y fechas.
 
@@ -78,15 +378,14 @@ def filter_alimentacion_data(alimentacion_df, supermercado, fecha_inicio, fecha_
         supermercado (str): Supermercado seleccionado.
         fecha_inicio (datetime): Fecha de inicio del rango.
         fecha_fin (datetime): Fecha de fin del rango.
+        indice (dict): Índice de alimentacion_df devuelto por indexar_por_fecha, si lo hay.
 
     Returns:
         DataFrame: Datos filtrados por supermercado y fechas.
     """
-    return alimentacion_df[
-        (alimentacion_df["fuente"] == supermercado)
-        & (alimentacion_df["fecha"] >= pd.to_datetime(fecha_inicio))
-        & (alimentacion_df["fecha"] <= pd.to_datetime(fecha_fin))
-    ]
+    return filtrar_por_clave_y_fechas(
+        alimentacion_df, "fuente", supermercado, fecha_inicio, fecha_fin, indice
+    )
 
 
 def plot_inflation_trend(category_infl, date_range):
@@ -100,28 +399,32 @@ def plot_inflation_trend(category_infl, date_range):
     Returns:
         fig (go.Figure): Figura de Plotly con la gráfica de la tendencia de inflación.
     """
+    import plotly.graph_objects as go
+
     fig = go.Figure()
     time_periods = {
         "3 month": date.today() - timedelta(days=91),
         "6 Months": date.today() - timedelta(days=180),
         "1 year": date.today() - timedelta(days=365),
-        "5 years": date.today() - timedelta(days=720),
+        "5 years": date.today() - timedelta(days=5 * 365),
     }
 
-    for category in category_infl["category"].unique():
-        category_data = category_infl[
-            category_infl["category"] == category
-        ].sort_values("fecha")
+    periodo = category_infl[category_infl["fecha"].dt.date > time_periods[date_range]]
+    # Como mucho un punto por píxel y serie; con muchos puntos se dibuja con WebGL
+    periodo = downsampleFrame(periodo, "fecha", "inflation", by="category")
+    if len(periodo) > WEBGL_MIN_POINTS:
+        scatter, mode = go.Scattergl, "lines"
+    else:
+        scatter, mode = go.Scatter, "lines+markers"
 
-        category_data = category_data[
-            category_data["fecha"].dt.date > time_periods[date_range]
-        ]
+    for category in category_infl["category"].unique():
+        category_data = periodo[periodo["category"] == category]
 
         fig.add_trace(
-            go.Scatter(
+            scatter(
                 x=category_data["fecha"],
                 y=category_data["inflation"],
-                mode="lines+markers",
+                mode=mode,
                 name=category.capitalize(),
             )
         )
@@ -150,6 +453,7 @@ def plot_inflation_trend(category_infl, date_range):
     return fig
 
 
+@timed()
 def display_metrics(category_infl, metric_type):
     """
     Muestra las métricas de inflación máximas o mínimas por categoría.
@@ -180,6 +484,145 @@ def display_metrics(category_infl, metric_type):
             )
 
 
+@st.cache_resource
+def load_provincias():
+    """
+    Carga una vez por proceso el geojson simplificado de las provincias.
+
+    Returns:
+        geojson (dict): Geometrías de las provincias.
+        nombres (dict): Nombre normalizado de cada provincia -> nombre en el geojson.
+    """
+    geojson = loadGeojson()
+    return geojson, provinciaNames(geojson)
+
+
+# Capa coroplética ya serializada: al dibujar el mapa solo se inserta el texto
+PLANTILLA_CAPA = """
+{% macro script(this, kwargs) %}
+    var {{ this.get_name() }} = L.geoJson({{ this.datos }}, {
+        style: function(feature) { return feature.properties.estilo; }
+    }).addTo({{ this._parent.get_name() }});
+{% endmacro %}
+"""
+
+
+@st.cache_resource(max_entries=32)
+@timed()
+def capa_mapa_provincias(
+    producto_tipo, fecha_inicio, fecha_fin, data_version, _precios_promedio_provincia
+):
+    """
+    Prepara la capa coroplética de precios por provincia: el geojson con el estilo de
+    cada provincia ya serializado y los parámetros de la leyenda.
+
+    La capa se guarda en caché por (producto_tipo, rango de fechas, versión de los datos),
+    así que las interacciones que no cambian esos filtros no la vuelven a calcular ni a
+    serializar. Se guardan texto y datos, no objetos de folium, que st_folium modifica
+    al dibujarlos.
+
+    Args:
+        producto_tipo (str): Tipo de producto, 'Venta' o 'Alquiler'.
+        fecha_inicio (datetime): Fecha de inicio del rango.
+        fecha_fin (datetime): Fecha de fin del rango.
+        data_version (int): Versión de los datos de precios.
+        _precios_promedio_provincia (DataFrame): Precio promedio por provincia (no forma parte de la clave).
+
+    Returns:
+        dict: 'plantilla' (Template que dibuja la capa), 'datos' (geojson serializado
+              con el estilo en properties['estilo']) y 'leyenda' (argumentos de branca
+              StepColormap, o None), de solo lectura.
+    """
+    import folium
+    from branca.element import Template
+    from jinja2.utils import htmlsafe_json_dumps
+
+    geojson_provincias, nombres_provincias = load_provincias()
+    precios = _precios_promedio_provincia.assign(
+        provincia=joinProvincias(
+            _precios_promedio_provincia["provincia"].astype(str), nombres_provincias
+        )
+    )
+
+    # Folium calcula los intervalos y colores; solo se guarda su resultado
+    coropletico = folium.Choropleth(
+        geo_data=geojson_provincias,
+        data=precios,
+        columns=["provincia", "precio"],
+        key_on="feature.properties.name",
+        fill_color="YlGnBu",
+        fill_opacity=0.7,
+        line_opacity=0.2,
+        legend_name="Precio promedio (€)",
+    )
+    features = [
+        {
+            "type": "Feature",
+            "properties": {
+                "name": feature["properties"]["name"],
+                "estilo": coropletico.geojson.style_function(feature),
+            },
+            "geometry": feature["geometry"],
+        }
+        for feature in geojson_provincias["features"]
+    ]
+    escala = coropletico.color_scale
+    leyenda = None
+    if escala is not None:
+        leyenda = {
+            "colors": escala.colors,
+            "index": [float(limite) for limite in escala.index],
+            "vmin": escala.vmin,
+            "vmax": escala.vmax,
+            "caption": escala.caption,
+        }
+    return {
+        "plantilla": Template(PLANTILLA_CAPA),
+        "datos": htmlsafe_json_dumps(
+            {"type": "FeatureCollection", "features": features}
+        ),
+        "leyenda": leyenda,
+    }
+
+
+@timed()
+def crear_mapa_provincias(capa):
+    """
+    Crea el mapa coroplético a partir de una capa ya calculada.
+
+    Solo el mapa, la leyenda y el elemento que inserta la capa se crean en cada
+    ejecución: st_folium los modifica al dibujarlos, así que no pueden compartirse
+    entre sesiones.
+
+    Args:
+        capa (dict): Capa devuelta por capa_mapa_provincias.
+
+    Returns:
+        folium.Map: Mapa centrado en España con la capa coroplética.
+    """
+    import folium
+    from branca.colormap import StepColormap
+    from branca.element import MacroElement
+
+    # Crear el mapa base centrado en España
+    mapa = folium.Map(
+        location=[40.4168, -3.7038], zoom_start=6, tiles="cartodb positron"
+    )
+
+    # Añadir la capa coroplética. st_folium solo usa su macro `script`; al renderizar
+    # la figura completa se omite, para no recompilar el geojson como plantilla
+    coropletico = MacroElement()
+    coropletico._name = "Coropletico"
+    coropletico._template = capa["plantilla"]
+    coropletico.datos = capa["datos"]
+    coropletico.render = lambda **kwargs: None
+    mapa.add_child(coropletico)
+
+    if capa["leyenda"] is not None:
+        StepColormap(**capa["leyenda"]).add_to(mapa)
+    return mapa
+
+
 def obtener_provincia_mas_cara_y_mas_barata(df_vivienda_filtrado):
     """
     Retorna la provincia más cara y más barata según el precio.
@@ -197,8 +640,10 @@ def obtener_provincia_mayor_aumento_y_disminucion(df_vivienda_filtrado):
     """
     Retorna la provincia que más ha aumentado y más ha disminuido en valor.
     """
-    df_vivienda_filtrado["diferencia"] = (
-        df_vivienda_filtrado.groupby("provincia")["precio"].diff().fillna(0)
+    df_vivienda_filtrado = df_vivienda_filtrado.assign(
+        diferencia=df_vivienda_filtrado.groupby("provincia", observed=True)["precio"]
+        .diff()
+        .fillna(0)
     )
     provincia_mayor_aumento = df_vivienda_filtrado.loc[
         df_vivienda_filtrado["diferencia"].idxmax()
@@ -217,8 +662,10 @@ def obtener_provincias_con_mas_variacion_en_ultimos_30_dias(df_vivienda_filtrado
         df_vivienda_filtrado["fecha"]
         >= (df_vivienda_filtrado["fecha"].max() - pd.Timedelta(days=30))
     ]
-    ultimo_mes_vivienda["variacion"] = (
-        ultimo_mes_vivienda.groupby("provincia")["precio"].pct_change().fillna(0)
+    ultimo_mes_vivienda = ultimo_mes_vivienda.assign(
+        variacion=ultimo_mes_vivienda.groupby("provincia", observed=True)["precio"]
+        .pct_change()
+        .fillna(0)
     )
 
     top_aumento_provincias = ultimo_mes_vivienda.nlargest(5, "variacion")
@@ -245,8 +692,10 @@ def obtener_producto_mayor_aumento_y_disminucion(df_filtrado):
     """
     Retorna el producto que más ha aumentado y más ha disminuido en valor.
     """
-    df_filtrado["diferencia"] = (
-        df_filtrado.groupby("producto")["precio_referencia"].diff().fillna(0)
+    df_filtrado = df_filtrado.assign(
+        diferencia=df_filtrado.groupby("producto", observed=True)["precio_referencia"]
+        .diff()
+        .fillna(0)
     )
     producto_mayor_aumento = df_filtrado.loc[df_filtrado["diferencia"].idxmax()]
     producto_mayor_disminucion = df_filtrado.loc[df_filtrado["diferencia"].idxmin()]
@@ -260,8 +709,8 @@ def obtener_productos_con_mas_variacion_ultima_semana(df_filtrado):
     ultima_semana = df_filtrado[
         df_filtrado["fecha"] >= (df_filtrado["fecha"].max() - pd.Timedelta(days=14))
     ]
-    ultima_semana["variacion"] = (
-        ultima_semana.groupby("producto")["precio_referencia"]
+    ultima_semana = ultima_semana.assign(
+        variacion=ultima_semana.groupby("producto", observed=True)["precio_referencia"]
         .pct_change(periods=14)
         .fillna(0)
     )
@@ -280,33 +729,51 @@ def comparar_precios_entre_supermercados(alimentacion_df):
     Retorna los productos más baratos en promedio por supermercado.
     """
     precios_promedio = (
-        alimentacion_df.groupby(["fuente", "producto"])["precio_referencia"]
+        alimentacion_df.groupby(["fuente", "producto"], observed=True)[
+            "precio_referencia"
+        ]
         .mean()
         .reset_index()
     )
     productos_mas_baratos = precios_promedio.loc[
-        precios_promedio.groupby("producto")["precio_referencia"].idxmin()
+        precios_promedio.groupby("producto", observed=True)[
+            "precio_referencia"
+        ].idxmin()
     ]
     return productos_mas_baratos
 
 
-# Cargar los datos
-prod_prices, category_infl = load_data()
-alimentacion_df = prod_prices["alimentacion"]
-vivienda_df = prod_prices["vivienda"]
-energia_df = prod_prices["energia"]
+def grafico_evolucion_precios(df_filtrado):
+    """
+    Gráfico de líneas con la evolución del precio de cada producto.
+
+    Cada producto se reduce a los puntos que caben en la gráfica; al acotar las
+    fechas de inicio y fin se vuelve a la resolución completa.
+    """
+    import plotly.express as px
+
+    df_grafico = downsampleFrame(
+        df_filtrado, "fecha", "precio_referencia", by="producto"
+    )
+    return px.line(
+        df_grafico,
+        x="fecha",
+        y="precio_referencia",
+        color="producto",
+        title="Evolución de precios por producto",
+        labels={"precio_referencia": "Precio (€)"},
+        render_mode="webgl" if len(df_grafico) > WEBGL_MIN_POINTS else "svg",
+    )
 
-alimentacion_df["producto"] = alimentacion_df["producto"].str.capitalize()
-vivienda_df = vivienda_df[vivienda_df["provincia"] != "España"]
-vivienda_df["producto"] = vivienda_df["producto"].str.capitalize()
 
-# Mostrar el menú lateral
-menu = display_sidebar_menu()
+@st.fragment
+def seccion_tendencia_inflacion():
+    """
+    Selector de periodo y gráfica de la tendencia de inflación por categorías.
 
-# Mostrar análisis general
-if menu == "General":
-    st.title("Inflación en España - Chainflation")
-    st.divider()
+    Es un fragmento: al cambiar el periodo solo se vuelve a ejecutar esta sección.
+    """
+    category_infl = load_category_infl()
 
     col1, col2 = st.columns([1, 3])
     with col1:
@@ -316,41 +783,46 @@ if menu == "General":
             index=2,
         )
     with st.container(border=True):
-        fig = plot_inflation_trend(category_infl, date_range)
-        st.plotly_chart(fig)
+        with span("grafico:inflacion_categorias") as registro:
+            registro["rows"] = len(category_infl)
+            fig = plot_inflation_trend(category_infl, date_range)
+            st.plotly_chart(fig)
 
-    col1, col2 = st.columns(2)
-    with col1:
-        st.subheader("Máximos registrados")
-        display_metrics(category_infl, "max")
-    with col2:
-        st.subheader("Mínimos registrados")
-        display_metrics(category_infl, "min")
 
+@st.fragment
+def seccion_productos_supermercado():
+    """
+    Filtros de supermercado y fechas con las métricas, la evolución de precios y los
+    productos que más han variado, que dependen de esos mismos filtros.
 
-if menu == "Precios de Alimentos":
-    # Análisis de precios de alimentos
-    st.title("📊 Análisis de Precios de Alimentos")
-    st.divider()
+    Es un fragmento: al cambiar un filtro solo se vuelve a ejecutar esta sección, no
+    la comparación entre supermercados.
+    """
+    import plotly.express as px
+
+    views = load_alimentacion()
 
     # Columna para los filtros principales
     col1, col2, col3 = st.columns([1, 1, 1])
     with col1:
-        supermercados = alimentacion_df["fuente"].unique()
+        supermercados = views["supermercados"]
         supermercado_seleccionado = st.selectbox(
             "Selecciona un supermercado", supermercados
         )
+    inicio_cargado, fin_cargado = rango_cargado(views["alimentacion"])
     with col2:
-        fecha_inicio = st.date_input("Fecha de inicio", pd.to_datetime("2024-01-01"))
+        fecha_inicio = st.date_input("Fecha de inicio", inicio_cargado)
     with col3:
-        fecha_fin = st.date_input("Fecha de fin", pd.to_datetime("2024-12-31"))
+        fecha_fin = st.date_input("Fecha de fin", fin_cargado)
 
     # Filtrar los datos por supermercado y por rango de fechas
+    alimentacion_df, indice = vista_con_historia(views, "alimentacion", fecha_inicio)
     df_filtrado = filter_alimentacion_data(
         alimentacion_df=alimentacion_df,
         supermercado=supermercado_seleccionado,
         fecha_inicio=fecha_inicio,
         fecha_fin=fecha_fin,
+        indice=indice,
     )
 
     producto_mas_caro, producto_mas_barato = obtener_producto_mas_caro_y_mas_barato(
@@ -359,8 +831,15 @@ if menu == "Precios de Alimentos":
     producto_mayor_aumento, producto_mayor_disminucion = (
         obtener_producto_mayor_aumento_y_disminucion(df_filtrado)
     )
-    top_variacion = obtener_productos_con_mas_variacion_ultima_semana(df_filtrado)
-    productos_mas_baratos = comparar_precios_entre_supermercados(alimentacion_df)
+
+    # Las figuras solo dependen de la versión de los datos y de los filtros
+    clave_filtros = (
+        views["version"],
+        "alimentos",
+        supermercado_seleccionado,
+        fecha_inicio,
+        fecha_fin,
+    )
 
     col1, col2 = st.columns([2, 4])
     with col1:
@@ -419,33 +898,49 @@ if menu == "Precios de Alimentos":
     st.subheader(
         "📈 Evolución de precios de productos en el supermercado", divider="blue"
     )
-    fig = px.line(
-        df_filtrado,
-        x="fecha",
-        y="precio_referencia",
-        color="producto",
-        title="Evolución de precios por producto",
-        labels={"precio_referencia": "Precio (€)"},
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    with span("grafico:evolucion_precios") as registro:
+        registro["rows"] = len(df_filtrado)
+        fig = figura_cacheada(
+            clave_filtros + ("evolucion_precios",),
+            lambda: grafico_evolucion_precios(df_filtrado),
+        )
+        st.plotly_chart(fig, use_container_width=True)
 
     # Gráfico de barras para los 5 productos que más han subido y bajado
     st.subheader(
         " 📊 Productos que más han subido y bajado en la última semana", divider="blue"
     )
-    fig_variacion = px.bar(
-        top_variacion,
-        x="producto",
-        y="variacion",
-        color="variacion",
-        title="Top 5 productos que más han subido y bajado en la última semana",
-        labels={"variacion": "Cambio porcentual (%)", "producto": "Producto"},
-        color_continuous_scale="agsunset",
-    )
-    fig_variacion.update_layout(
-        barmode="group", yaxis_title="Cambio porcentual (%)", xaxis_title="Producto"
-    )
-    st.plotly_chart(fig_variacion, use_container_width=True)
+    with span("grafico:top_variacion") as registro:
+        registro["rows"] = len(df_filtrado)
+        fig_variacion = figura_cacheada(
+            clave_filtros + ("top_variacion",),
+            lambda: px.bar(
+                obtener_productos_con_mas_variacion_ultima_semana(df_filtrado),
+                x="producto",
+                y="variacion",
+                color="variacion",
+                title="Top 5 productos que más han subido y bajado en la última semana",
+                labels={"variacion": "Cambio porcentual (%)", "producto": "Producto"},
+                color_continuous_scale="agsunset",
+            ).update_layout(
+                barmode="group",
+                yaxis_title="Cambio porcentual (%)",
+                xaxis_title="Producto",
+            ),
+        )
+        st.plotly_chart(fig_variacion, use_container_width=True)
+
+
+def seccion_comparacion_supermercados():
+    """
+    Comparación de los productos más baratos entre supermercados.
+
+    No depende de ningún filtro, así que solo se ejecuta al cargar la página.
+    """
+    import plotly.express as px
+
+    views = load_alimentacion()
+    productos_mas_baratos = views["productos_mas_baratos"]
 
     st.markdown("")
     # Comparación de productos más baratos entre supermercados
@@ -453,36 +948,92 @@ if menu == "Precios de Alimentos":
         " 🛒 Comparación de productos más baratos entre supermercados", divider="blue"
     )
     # Graficar comparativa de precios más baratos entre supermercados
-    fig_bar = px.bar(
-        productos_mas_baratos,
-        x="producto",
-        y="precio_referencia",
-        color="fuente",
-        title="Comparativa de productos más baratos entre supermercados",
-        labels={"precio_referencia": "Precio (€)", "producto": "Producto"},
-        barmode="group",
-    )
-    fig_bar.update_layout(xaxis_title="Producto", yaxis_title="Precio (€)")
-    col1, col2 = st.columns(2)
-    with col1:
-        st.plotly_chart(fig_bar, use_container_width=True)
-
-    # Pie chart con hueco en el centro y con valores
-    fig_pie = px.pie(
-        productos_mas_baratos,
-        values="precio_referencia",
-        names="fuente",
-        title="Distribución de productos más baratos por supermercado",
-        hole=0.4,
-    )
-    fig_pie.update_traces(textinfo="percent+label")
-    with col2:
-        st.plotly_chart(fig_pie, use_container_width=True)
+    with span("grafico:comparacion_supermercados") as registro:
+        registro["rows"] = len(productos_mas_baratos)
+        # No depende de los filtros, solo de la versión de los datos
+        clave_comparacion = (views["version"], "alimentos", "comparacion")
+        fig_bar = figura_cacheada(
+            clave_comparacion + ("barras",),
+            lambda: px.bar(
+                productos_mas_baratos,
+                x="producto",
+                y="precio_referencia",
+                color="fuente",
+                title="Comparativa de productos más baratos entre supermercados",
+                labels={"precio_referencia": "Precio (€)", "producto": "Producto"},
+                barmode="group",
+            ).update_layout(xaxis_title="Producto", yaxis_title="Precio (€)"),
+        )
+        col1, col2 = st.columns(2)
+        with col1:
+            st.plotly_chart(fig_bar, use_container_width=True)
+
+        # Pie chart con hueco en el centro y con valores
+        fig_pie = figura_cacheada(
+            clave_comparacion + ("tarta",),
+            lambda: px.pie(
+                productos_mas_baratos,
+                values="precio_referencia",
+                names="fuente",
+                title="Distribución de productos más baratos por supermercado",
+                hole=0.4,
+            ).update_traces(textinfo="percent+label"),
+        )
+        with col2:
+            st.plotly_chart(fig_pie, use_container_width=True)
+
+
+@st.fragment
+def seccion_mapa_provincias(
+    producto_tipo, fecha_inicio, fecha_fin, data_version, precios_promedio_provincia
+):
+    """
+    Muestra el mapa coroplético de precios por provincia.
+
+    st_folium devuelve el estado del mapa en cada zoom, desplazamiento o clic; como
+    fragmento propio, esas interacciones solo vuelven a ejecutar el mapa.
+
+    Args:
+        producto_tipo (str): Tipo de producto, 'Venta' o 'Alquiler'.
+        fecha_inicio (datetime): Fecha de inicio del rango.
+        fecha_fin (datetime): Fecha de fin del rango.
+        data_version (int): Versión de los datos de precios.
+        precios_promedio_provincia (DataFrame): Precio promedio por provincia.
+    """
+    from streamlit_folium import st_folium
+
+    # Crear mapa coroplético con Folium
+    st.subheader("🌍 Precios por Provincias en Mapa Coroplético")
+
+    try:
+        load_provincias()
+    except OSError:
+        # Sin geometrías no hay mapa, pero el resto de la página se sigue mostrando
+        st.warning("No se han podido cargar las geometrías de las provincias.")
+        return
+
+    with span("grafico:mapa_provincias") as registro:
+        registro["rows"] = len(precios_promedio_provincia)
+        capa = capa_mapa_provincias(
+            producto_tipo,
+            fecha_inicio,
+            fecha_fin,
+            data_version,
+            precios_promedio_provincia,
+        )
+        st_folium(crear_mapa_provincias(capa), width=700)
 
-elif menu == "Precios de Vivienda":
-    # Filtro de Venta o Alquiler
-    st.title("🏡 Análisis de Precios de Vivienda por Provincias")
-    st.divider()
+
+@st.fragment
+def seccion_vivienda():
+    """
+    Filtros de venta o alquiler y fechas con las métricas y gráficos de vivienda.
+
+    Es un fragmento: al cambiar un filtro solo se vuelve a ejecutar esta sección.
+    """
+    import plotly.express as px
+
+    views = load_vivienda()
 
     # Filtro de fechas
     col1, col2, col3 = st.columns([1, 2, 2])
@@ -490,19 +1041,20 @@ elif menu == "Precios de Vivienda":
         producto_tipo = st.radio(
             "Selecciona si es venta o alquiler", ["Venta", "Alquiler"]
         )
+    inicio_cargado, fin_cargado = rango_cargado(views["vivienda"])
     with col2:
-        fecha_inicio_vivienda = st.date_input(
-            "Fecha de inicio", pd.to_datetime("2024-01-01")
-        )
+        fecha_inicio_vivienda = st.date_input("Fecha de inicio", inicio_cargado)
     with col3:
-        fecha_fin_vivienda = st.date_input("Fecha de fin", pd.to_datetime("2024-12-31"))
+        fecha_fin_vivienda = st.date_input("Fecha de fin", fin_cargado)
 
         # Filtrar los datos por tipo de producto (venta o alquiler) y rango de fechas
+    vivienda_df, indice = vista_con_historia(views, "vivienda", fecha_inicio_vivienda)
     df_vivienda_filtrado = filter_vivienda_data(
         vivienda_df=vivienda_df,
         producto_tipo=producto_tipo,
         fecha_inicio=fecha_inicio_vivienda,
         fecha_fin=fecha_fin_vivienda,
+        indice=indice,
     )
 
     provincia_mas_cara, provincia_mas_barata = obtener_provincia_mas_cara_y_mas_barata(
@@ -511,8 +1063,12 @@ elif menu == "Precios de Vivienda":
     provincia_mayor_aumento, provincia_mayor_disminucion = (
         obtener_provincia_mayor_aumento_y_disminucion(df_vivienda_filtrado)
     )
-    top_variacion_provincias = obtener_provincias_con_mas_variacion_en_ultimos_30_dias(
-        df_vivienda_filtrado
+    clave_filtros = (
+        views["version"],
+        "vivienda",
+        producto_tipo,
+        fecha_inicio_vivienda,
+        fecha_fin_vivienda,
     )
 
     st.markdown("")
@@ -559,79 +1115,110 @@ elif menu == "Precios de Vivienda":
                 help="Esta provincia ha tenido el mayor diminución de precios.",
             )
 
-    # Filtrar los datos por tipo de producto (venta o alquiler) y rango de fechas
-    df_vivienda_filtrado = vivienda_df[
-        (vivienda_df["producto"] == producto_tipo)
-        & (vivienda_df["fecha"] >= pd.to_datetime(fecha_inicio_vivienda))
-        & (vivienda_df["fecha"] <= pd.to_datetime(fecha_fin_vivienda))
-    ]
-
     # Agrupar los precios promedio por provincia
     precios_promedio_provincia = (
-        df_vivienda_filtrado.groupby("provincia")["precio"].mean().reset_index()
+        df_vivienda_filtrado.groupby("provincia", observed=True)["precio"]
+        .mean()
+        .reset_index()
     )
 
-    # Descargar el geojson de las provincias de España para el mapa
-    geojson_url = "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/spain-provinces.geojson"
-    response = requests.get(geojson_url)
-    geojson_provincias = response.json()
-
     # Mostrar mapa en Streamlit
     col1, col2 = st.columns(2)
     with col1:
-        # Crear mapa coroplético con Folium
-        st.subheader("🌍 Precios por Provincias en Mapa Coroplético")
-
-        # Crear el mapa base centrado en España
-        mapa = folium.Map(
-            location=[40.4168, -3.7038], zoom_start=6, tiles="cartodb positron"
+        seccion_mapa_provincias(
+            producto_tipo,
+            fecha_inicio_vivienda,
+            fecha_fin_vivienda,
+            views["version"],
+            precios_promedio_provincia,
         )
 
-        # Añadir capa de Choropleth (Mapa Coroplético)
-        folium.Choropleth(
-            geo_data=geojson_provincias,
-            name="choropleth",
-            data=precios_promedio_provincia,
-            columns=["provincia", "precio"],
-            key_on="feature.properties.name",  # Asegúrate de que 'name' coincide con las provincias
-            fill_color="YlGnBu",
-            fill_opacity=0.7,
-            line_opacity=0.2,
-            legend_name="Precio promedio (€)",
-        ).add_to(mapa)
-        st_data = st_folium(mapa, width=700)
-
     # Gráfico de barras con precios por provincia
     with col2:
         st.subheader(" 📊 Provincias ordenadas por precio promedio")
-        fig_bar_provincias = px.bar(
-            precios_promedio_provincia.sort_values("precio", ascending=False),
-            x="provincia",
-            y="precio",
-            color="precio",
-            title="Provincias ordenadas por precio promedio",
-            labels={"precio": "Precio promedio (€)", "provincia": "Provincia"},
-            color_continuous_scale=px.colors.sequential.Blues,
-        )
-        fig_bar_provincias.update_layout(
-            yaxis_title="Precio promedio (€)", xaxis_title="Provincia", height=650
-        )
-        st.plotly_chart(fig_bar_provincias, use_container_width=True)
+        with span("grafico:precio_provincias") as registro:
+            registro["rows"] = len(precios_promedio_provincia)
+            fig_bar_provincias = figura_cacheada(
+                clave_filtros + ("precio_provincias",),
+                lambda: px.bar(
+                    precios_promedio_provincia.sort_values("precio", ascending=False),
+                    x="provincia",
+                    y="precio",
+                    color="precio",
+                    title="Provincias ordenadas por precio promedio",
+                    labels={"precio": "Precio promedio (€)", "provincia": "Provincia"},
+                    color_continuous_scale=px.colors.sequential.Blues,
+                ).update_layout(
+                    yaxis_title="Precio promedio (€)",
+                    xaxis_title="Provincia",
+                    height=650,
+                ),
+            )
+            st.plotly_chart(fig_bar_provincias, use_container_width=True)
 
         # Gráfico de barras para las provincias con mayor variación
     st.subheader(
         "📊 Provincias que más han subido y bajado en precio en el último mes",
         divider="blue",
     )
-    fig_variacion_provincias = px.bar(
-        top_variacion_provincias,
-        x="provincia",
-        y="variacion",
-        color="variacion",
-        labels={"variacion": "Cambio porcentual (%)", "provincia": "Provincia"},
-        color_continuous_scale=["red", "green"],
-    )
-    fig_variacion_provincias.update_layout(
-        barmode="group", yaxis_title="Cambio porcentual (%)", xaxis_title="Provincia"
-    )
-    st.plotly_chart(fig_variacion_provincias, use_container_width=True)
+    with span("grafico:variacion_provincias") as registro:
+        registro["rows"] = len(df_vivienda_filtrado)
+        fig_variacion_provincias = figura_cacheada(
+            clave_filtros + ("variacion_provincias",),
+            lambda: px.bar(
+                obtener_provincias_con_mas_variacion_en_ultimos_30_dias(
+                    df_vivienda_filtrado
+                ),
+                x="provincia",
+                y="variacion",
+                color="variacion",
+                labels={"variacion": "Cambio porcentual (%)", "provincia": "Provincia"},
+                color_continuous_scale=["red", "green"],
+            ).update_layout(
+                barmode="group",
+                yaxis_title="Cambio porcentual (%)",
+                xaxis_title="Provincia",
+            ),
+        )
+        st.plotly_chart(fig_variacion_provincias, use_container_width=True)
+
+
+# Mostrar el menú lateral
+menu = display_sidebar_menu()
+
+# Mostrar análisis general
+if menu == "General":
+    # Cada página carga solo sus datos, la primera vez que se abre
+    category_infl = load_category_infl()
+
+    st.title("Inflación en España - Chainflation")
+    st.divider()
+
+    seccion_tendencia_inflacion()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Máximos registrados")
+        display_metrics(category_infl, "max")
+    with col2:
+        st.subheader("Mínimos registrados")
+        display_metrics(category_infl, "min")
+
+
+if menu == "Precios de Alimentos":
+    # Análisis de precios de alimentos
+    st.title("📊 Análisis de Precios de Alimentos")
+    st.divider()
+
+    seccion_productos_supermercado()
+    seccion_comparacion_supermercados()
+
+elif menu == "Precios de Vivienda":
+    # Filtro de Venta o Alquiler
+    st.title("🏡 Análisis de Precios de Vivienda por Provincias")
+    st.divider()
+
+    seccion_vivienda()
+
+
+display_debug_panel()
@@ -0,0 +1,90 @@
+"""
+Downsampling of long time series before they are sent to the browser.
+
+Largest-Triangle-Three-Buckets (LTTB) keeps the first and last points and, from
+each bucket in between, the point that forms the largest triangle with its
+neighbours, so peaks and drops survive while the point count is bounded.
+"""
+
+import numpy as np
+
+# Points kept per series, about one per horizontal pixel of a full-width chart
+MAX_POINTS = 1000
+
+# Total points above which charts are drawn with WebGL instead of SVG
+WEBGL_MIN_POINTS = 5000
+
+
+def lttbIndices(x, y, threshold=MAX_POINTS):
+    """
+    Positions of the points kept by LTTB.
+
+    Args:
+        x (np.ndarray): Increasing x values (numbers or datetime64).
+        y (np.ndarray): y values, same length as x.
+        threshold (int): Maximum number of points to keep.
+
+    Returns:
+        np.ndarray: Sorted positions of the kept points.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("datetime64[ns]").astype(np.int64)
+    x = x.astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # The first and last points are kept, the rest is split in threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Third vertex: mean of the next bucket (or the last point)
+        if bucket + 2 < len(edges):
+            following = slice(end, edges[bucket + 2])
+            avg_x, avg_y = x[following].mean(), y[following].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+
+        area = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.nanargmax(area)) if np.isfinite(area).any() else start
+        kept[bucket + 1] = previous
+
+    return kept
+
+
+def downsampleFrame(df, x, y, by=None, threshold=MAX_POINTS):
+    """
+    Downsample every series of a long DataFrame with LTTB.
+
+    Args:
+        df (pd.DataFrame): Points in long format.
+        x (str): Column on the x axis.
+        y (str): Column on the y axis.
+        by (str): Column identifying each series, or None for a single series.
+        threshold (int): Maximum number of points per series.
+
+    Returns:
+        pd.DataFrame: The kept rows, sorted by series and x.
+    """
+    sort = [x] if by is None else [by, x]
+    df = df.sort_values(sort)
+    if by is None:
+        return df.iloc[lttbIndices(df[x].to_numpy(), df[y].to_numpy(), threshold)]
+
+    xs, ys = df[x].to_numpy(), df[y].to_numpy()
+    kept = [
+        positions[lttbIndices(xs[positions], ys[positions], threshold)]
+        for positions in df.groupby(by, observed=True).indices.values()
+    ]
+    return df.iloc[np.sort(np.concatenate(kept))] if kept else df
@@ -0,0 +1,136 @@
+"""
+Timing spans for the stages of a page load: MongoDB fetches, DataFrame building,
+inflation calculations and chart rendering.
+
+Every finished span is logged as one JSON line on the 'chainflation.metrics'
+logger and kept in memory so the dashboard can show p50/p95 per stage. Entry points
+call enableMetricsLog() to print those lines on stdout.
+"""
+
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from time import perf_counter
+
+import pandas as pd
+import psutil
+
+logger = logging.getLogger("chainflation.metrics")
+
+SPANS_PER_STAGE = 500  # Most recent spans kept per stage for the percentiles
+METRICS_LOG = os.environ.get("chainflation_metrics_log", "1") == "1"
+
+_spans = defaultdict(lambda: deque(maxlen=SPANS_PER_STAGE))
+_spans_lock = threading.Lock()
+_process = psutil.Process()
+_stdout_handler = None
+_stdout_handler_lock = threading.Lock()
+
+
+def enableMetricsLog(loggers=("chainflation.metrics",)):
+    """
+    Print the records of `loggers` on stdout, one per line, from INFO up.
+
+    Nothing else configures logging, so without this the span records are dropped.
+    Safe to call on every Streamlit rerun: the handler is only attached once. Disabled
+    with chainflation_metrics_log=0.
+    """
+    global _stdout_handler
+    if not METRICS_LOG:
+        return
+    with _stdout_handler_lock:
+        if _stdout_handler is None:
+            _stdout_handler = logging.StreamHandler(sys.stdout)
+            _stdout_handler.setFormatter(logging.Formatter("%(message)s"))
+        for name in loggers:
+            target = logging.getLogger(name)
+            if _stdout_handler not in target.handlers:
+                target.addHandler(_stdout_handler)
+                target.setLevel(logging.INFO)
+
+
+def countRows(result):
+    # Rows of a DataFrame or list, summed over the values of a dict or tuple
+    if isinstance(result, (dict, tuple)):
+        values = result.values() if isinstance(result, dict) else result
+        rows = [countRows(value) for value in values]
+        rows = [n for n in rows if n is not None]
+        return sum(rows) if rows else None
+    if hasattr(result, "__len__") and not isinstance(result, str):
+        return len(result)
+    return None
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Time the enclosed block as `stage`.
+
+    The yielded dict is the record that gets stored; set record["rows"] (or any other
+    field) inside the block to attach it.
+    """
+    record = {"stage": stage, **fields}
+    rss = _process.memory_info().rss
+    start = perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = perf_counter() - start
+        record["mem_delta_mb"] = (_process.memory_info().rss - rss) / 2**20
+        with _spans_lock:
+            _spans[stage].append(record)
+        logger.info(json.dumps(record, default=str))
+
+
+def timed(stage=None):
+    """
+    Decorator that runs the function inside a span and records the rows it returns.
+    """
+
+    def decorator(function):
+        name = stage or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name) as record:
+                result = function(*args, **kwargs)
+                record["rows"] = countRows(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def stageStats():
+    """
+    Summary of the recorded spans.
+
+    Returns:
+        pd.DataFrame: Per stage, number of spans, p50/p95 seconds, rows and memory
+                      delta of the last span.
+    """
+    with _spans_lock:
+        spans = {stage: list(records) for stage, records in _spans.items()}
+
+    stats = []
+    for stage, records in spans.items():
+        seconds = pd.Series([record["seconds"] for record in records])
+        stats.append(
+            {
+                "stage": stage,
+                "count": len(records),
+                "p50_s": seconds.quantile(0.5),
+                "p95_s": seconds.quantile(0.95),
+                "last_rows": records[-1].get("rows"),
+                "last_mem_delta_mb": records[-1]["mem_delta_mb"],
+            }
+        )
+    columns = ["stage", "count", "p50_s", "p95_s", "last_rows", "last_mem_delta_mb"]
+    stats = pd.DataFrame(stats, columns=columns).set_index("stage")
+    return stats.sort_values("p95_s", ascending=False)
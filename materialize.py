@@ -0,0 +1,154 @@
+"""
+Batch job that computes product, source, category and total inflation and stores
+it in MongoDB, so the dashboard only has to read precomputed results.
+
+Usage:
+    python materialize.py                    # YoY, only dates with new prices
+    python materialize.py --horizons MoM YoY
+    python materialize.py --full             # recompute the whole history
+    python materialize.py --workers 4        # calculations in 4 processes
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+from dotenv import load_dotenv
+from pymongo import ASCENDING, UpdateOne
+
+load_dotenv()
+
+from functions import *
+from instrumentation import enableMetricsLog
+
+# Extra history loaded before the first affected date, in case the reference day has no prices
+REF_MARGIN_DAYS = 30
+BULK_SIZE = 1000
+STATE_COLLECTION = "materialization_state"
+
+# Collection suffix and upsert key of each materialized result
+RESULTADOS = {
+    "product": ["sector", "producto", "fecha"],
+    "source": ["sector", "producto", "fuente", "fecha"],
+    "category": ["category", "fecha"],
+}
+
+
+def getWatermarks(mydb, horizonte):
+    # Last materialized price date of each sector; state from before per-sector
+    # watermarks has none, so it triggers one full recompute
+    state = mydb[STATE_COLLECTION].find_one({"_id": horizonte})
+    return {} if state is None else state.get("watermarks", {})
+
+
+def setWatermarks(mydb, horizonte, watermarks):
+    mydb[STATE_COLLECTION].update_one(
+        {"_id": horizonte},
+        {"$set": {"watermarks": watermarks}, "$unset": {"watermark": ""}},
+        upsert=True,
+    )
+
+
+def calcHorizonInflation(prod_prices, horizontes, workers=None):
+    """
+    Compute every materialized result for all the horizons in a single pass.
+
+    Returns:
+        Dict[str, pd.DataFrame]: 'product', 'source' and 'category' (including the total)
+                                 inflation, with a 'horizon' column.
+    """
+    # getProductInflationHorizons normalizes the frames in place, keep the loaded ones intact
+    sector_df = {sector: prices.copy() for sector, prices in prod_prices.items()}
+
+    prod_infl = getProductInflationHorizons(sector_df, horizontes, workers)
+    fuente_infl = getSourcesInflationHorizons(sector_df, horizontes, workers)
+    categs_infl = getTotalInflation(getCategoriesInflation(prod_infl, workers))
+
+    return {
+        "product": pd.concat(
+            [infl.assign(sector=sector) for sector, infl in prod_infl.items()]
+        ),
+        "source": pd.concat(
+            [infl.assign(sector=sector) for sector, infl in fuente_infl.items()]
+        ),
+        "category": categs_infl,
+    }
+
+
+def upsertFrame(collection, df, keys):
+    # Bulk upserts keyed by `keys`, sent in chunks of BULK_SIZE
+    collection.create_index([(key, ASCENDING) for key in keys], unique=True)
+
+    records = df.astype({col: "object" for col in df.select_dtypes("category")})
+    records = records.to_dict("records")
+    for start in range(0, len(records), BULK_SIZE):
+        operations = [
+            UpdateOne({key: record[key] for key in keys}, {"$set": record}, upsert=True)
+            for record in records[start : start + BULK_SIZE]
+        ]
+        collection.bulk_write(operations, ordered=False)
+
+
+def materialize(horizontes, full=False, workers=None):
+    mydb = getMongoClient()[DATABASE]
+
+    # Sectors receive prices on their own schedule, so only dates from the oldest
+    # sector watermark on can change
+    watermarks = {
+        horizonte: {} if full else getWatermarks(mydb, horizonte)
+        for horizonte in horizontes
+    }
+    sector_watermarks = [
+        watermarks[horizonte].get(sector)
+        for horizonte in horizontes
+        for sector in SECTORES
+    ]
+    if any(watermark is None for watermark in sector_watermarks):
+        since = None
+        desde = datetime(1970, 1, 1)
+    else:
+        since = pd.Timestamp(min(sector_watermarks)).normalize()
+        max_ago = max(HORIZONTES[horizonte] for horizonte in horizontes)
+        desde = since - timedelta(days=max_ago + REF_MARGIN_DAYS)
+
+    prod_prices = getDailyProductPrices(desde)
+    # A sector without new prices keeps its previous watermark
+    latest = {
+        sector: prices["fecha"].max()
+        for sector, prices in prod_prices.items()
+        if len(prices)
+    }
+
+    results = calcHorizonInflation(prod_prices, horizontes, workers)
+    for horizonte in horizontes:
+        for resultado, df in results.items():
+            df = df[df["horizon"] == horizonte].drop(columns="horizon")
+            if since is not None:
+                df = df[df["fecha"] >= since]
+            upsertFrame(
+                mydb[f"{horizonte}_inflation_{resultado}"], df, RESULTADOS[resultado]
+            )
+            print(f"{horizonte}_inflation_{resultado}: {len(df)} rows upserted")
+
+        setWatermarks(mydb, horizonte, {**watermarks[horizonte], **latest})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize Chainflation inflation")
+    parser.add_argument(
+        "--horizons", nargs="+", choices=list(HORIZONTES), default=["YoY"]
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Recompute the whole price history"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Processes for the per-sector and per-horizon calculations (1: none)",
+    )
+    args = parser.parse_args()
+
+    enableMetricsLog()
+    materialize(args.horizons, full=args.full, workers=args.workers)
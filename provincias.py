@@ -0,0 +1,143 @@
+"""
+Province geometry for the housing map.
+
+The GeoJSON is stored simplified in data/spain-provinces.geojson, which is committed
+with the code so the dashboard does not need to download it. Regenerate it with:
+    python provincias.py
+"""
+
+import json
+import os
+import logging
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+GEOJSON_URL = "https://raw.githubusercontent.com/codeforamerica/click_that_hood/master/public/data/spain-provinces.geojson"
+GEOJSON_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "spain-provinces.geojson"
+)
+
+# Douglas-Peucker tolerance and decimals kept, in degrees (~500 m and ~10 m)
+SIMPLIFY_TOLERANCE = 0.005
+COORD_PRECISION = 4
+
+
+def _normalizeProvincia(nombre):
+    nombre = unicodedata.normalize("NFKD", nombre.lower())
+    return nombre.encode("ascii", errors="ignore").decode("ascii").strip()
+
+
+def simplifyGeojson(geojson, tolerance=SIMPLIFY_TOLERANCE, precision=COORD_PRECISION):
+    """
+    Simplify the province polygons and keep only the 'name' property of each feature.
+    """
+    from shapely.geometry import mapping, shape
+
+    features = []
+    for feature in geojson["features"]:
+        geometry = shape(feature["geometry"]).simplify(
+            tolerance, preserve_topology=True
+        )
+        geometry = json.loads(
+            json.dumps(mapping(geometry)),
+            parse_float=lambda x: round(float(x), precision),
+        )
+        features.append(
+            {
+                "type": "Feature",
+                "properties": {"name": feature["properties"]["name"]},
+                "geometry": geometry,
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def downloadGeojson(timeout=30):
+    """
+    Download the province GeoJSON and simplify it, without storing it.
+    """
+    import requests
+
+    response = requests.get(GEOJSON_URL, timeout=timeout)
+    response.raise_for_status()
+    return simplifyGeojson(response.json())
+
+
+def buildGeojson():
+    """
+    Download the province GeoJSON, simplify it and store it in GEOJSON_PATH.
+    """
+    geojson = downloadGeojson()
+
+    os.makedirs(os.path.dirname(GEOJSON_PATH), exist_ok=True)
+    with open(GEOJSON_PATH, "w", encoding="utf-8") as f:
+        json.dump(geojson, f, ensure_ascii=False, separators=(",", ":"))
+    return geojson
+
+
+def loadGeojson():
+    """
+    Read the bundled province GeoJSON.
+
+    If the file has not been generated yet it is downloaded into memory instead; the
+    source tree is never written at runtime.
+
+    Raises:
+        OSError: If the file is missing and the download fails.
+    """
+    if not os.path.exists(GEOJSON_PATH):
+        logger.warning(
+            "%s is missing, downloading it; generate it with `python provincias.py` "
+            "and commit it",
+            GEOJSON_PATH,
+        )
+        return downloadGeojson(timeout=10)
+    with open(GEOJSON_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def provinciaNames(geojson):
+    """
+    Map every spelling of a province name to the name used in the GeoJSON.
+
+    Names like "Alacant/Alicante" or "Balears, Illes" are indexed by each of their
+    parts too, and all keys are lowercased and without accents.
+
+    Returns:
+        Dict[str, str]: Normalized province name -> GeoJSON feature name.
+    """
+    names = {}
+    for feature in geojson["features"]:
+        name = feature["properties"]["name"]
+        aliases = [name, *name.split("/")]
+        if ", " in name:
+            # "Balears, Illes" -> "Illes Balears"
+            aliases.append(" ".join(reversed(name.split(", ", 1))))
+        for alias in aliases:
+            names.setdefault(_normalizeProvincia(alias), name)
+    return names
+
+
+def joinProvincias(provincias, names):
+    """
+    Translate province names from the price data to GeoJSON feature names.
+
+    Args:
+        provincias (pd.Series): Province names as stored in MongoDB.
+        names (Dict[str, str]): Mapping returned by provinciaNames.
+
+    Returns:
+        pd.Series: GeoJSON name of each province, or the original name if unknown.
+    """
+    unique = provincias.drop_duplicates()
+    joined = {
+        provincia: names.get(_normalizeProvincia(provincia), provincia)
+        for provincia in unique
+    }
+    return provincias.map(joined)
+
+
+if __name__ == "__main__":
+    geojson = buildGeojson()
+    print(f"{len(geojson['features'])} provinces written to {GEOJSON_PATH}")
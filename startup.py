@@ -0,0 +1,90 @@
+"""
+Import cost of the dashboard, measured in a fresh interpreter with `python -X importtime`.
+
+Reports how long each top-level module imported by a page takes, including its
+dependencies not imported before it, and the modules with the largest own cost.
+
+Usage:
+    python startup.py                      # what every page imports
+    python startup.py --page vivienda      # plus what a page imports on first open
+    python startup.py --top 30
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+# Modules imported at the top of dashboard.py, and by each page when opened
+IMPORTS = {
+    "startup": [
+        "streamlit",
+        "numpy",
+        "pandas",
+        "dotenv",
+        "functions",
+        "cache",
+        "downsample",
+        "instrumentation",
+        "provincias",
+        "streamlit_option_menu",
+    ],
+    "general": ["plotly.graph_objects"],
+    "alimentacion": ["plotly.express", "plotly.io"],
+    "vivienda": ["plotly.express", "plotly.io", "folium", "streamlit_folium"],
+}
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measureImports(modules):
+    """
+    Import `modules` in order in a new interpreter.
+
+    Returns:
+        List[Tuple[str, int, int, int]]: (module, self µs, cumulative µs, depth) of
+                                         every module imported, in import order.
+    """
+    code = "; ".join(f"import {module}" for module in modules) or "pass"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            imports.append((module, int(own), int(cumulative), len(indent) // 2))
+    return imports
+
+
+def report(modules, top=15):
+    imports = measureImports(modules)
+    total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+
+    print(f"{'module':<40} {'cumulative':>12}")
+    requested = {module for module in modules}
+    for module, _, cumulative, depth in imports:
+        if depth == 0 and module in requested:
+            print(f"{module:<40} {cumulative / 1000:>10.1f}ms")
+    print(f"{'total':<40} {total / 1000:>10.1f}ms")
+
+    print(f"\n{'largest own cost':<40} {'self':>12}")
+    for module, own, _, _ in sorted(imports, key=lambda i: i[1], reverse=True)[:top]:
+        print(f"{module:<40} {own / 1000:>10.1f}ms")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the dashboard import time")
+    parser.add_argument(
+        "--page", choices=[page for page in IMPORTS if page != "startup"]
+    )
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    modules = IMPORTS["startup"] + IMPORTS.get(args.page, [])
+    report(list(dict.fromkeys(modules)), top=args.top)